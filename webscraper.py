@@ -1,11 +1,119 @@
+import aiofiles
 import aiohttp
 import asyncio
-from bs4 import BeautifulSoup
+import atexit
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from bs4 import BeautifulSoup, SoupStrainer
+from selectolax.lexbor import LexborHTMLParser
 from urllib.parse import urljoin, urlparse
 import json
 import os
+import re
+import sqlite3
 import time
 
+# Links containing any of these substrings are never followed
+SKIP_PATTERN = re.compile("|".join(map(re.escape, ["lxml"])), re.IGNORECASE)
+PDF_PATTERN = re.compile(r"\.pdf$", re.IGNORECASE)
+# Hrefs that never point at another page
+IGNORED_HREF_PATTERN = re.compile(r"#|(?:javascript|mailto|tel):", re.IGNORECASE)
+ABSOLUTE_HREF_PATTERN = re.compile(r"[a-z][a-z0-9+.\-]*:|//", re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=100_000)
+def url_to_filename(data_folder, url):
+    """
+    Generates the path in data_folder where the content of a URL is saved.
+    Results are cached, up to maxsize entries, since a URL is looked up on resume and on write.
+    """
+    parsed_url = urlparse(url)
+    path = parsed_url.path.strip("/").replace("/", "_")
+    if not path:
+        path = "index"
+    return os.path.join(data_folder, f"{parsed_url.netloc}_{path}.txt")
+
+
+class LinkStatus:
+    """
+    Stores the status of visited links in a SQLite database in WAL mode,
+    so each status change is written on its own instead of rewriting every link.
+    Supports the dictionary operations the scraper uses on visitedlinks.
+    """
+    def __init__(self, db_file):
+        """
+        Opens (or creates) the status database at db_file.
+        """
+        self.connection = sqlite3.connect(db_file, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS links (url TEXT PRIMARY KEY, status TEXT NOT NULL)")
+
+    def __contains__(self, url):
+        """
+        Checks whether a URL has a recorded status.
+        """
+        return self.connection.execute(
+            "SELECT 1 FROM links WHERE url = ?", (url,)).fetchone() is not None
+
+    def __setitem__(self, url, status):
+        """
+        Records the status of a URL, replacing any previous one.
+        """
+        self.connection.execute(
+            "INSERT OR REPLACE INTO links (url, status) VALUES (?, ?)", (url, status))
+
+    def __len__(self):
+        """
+        Returns the number of URLs with a recorded status.
+        """
+        return self.connection.execute("SELECT COUNT(*) FROM links").fetchone()[0]
+
+    def get(self, url, default=None):
+        """
+        Returns the status of a URL, or default if it has not been seen.
+        """
+        row = self.connection.execute(
+            "SELECT status FROM links WHERE url = ?", (url,)).fetchone()
+        return row[0] if row else default
+
+    def unfinished(self):
+        """
+        Iterates over the URLs whose status is anything other than "success".
+        """
+        for row in self.connection.execute("SELECT url FROM links WHERE status != 'success'"):
+            yield row[0]
+
+    def finished(self):
+        """
+        Iterates over the URLs whose status is "success".
+        """
+        for row in self.connection.execute("SELECT url FROM links WHERE status = 'success'"):
+            yield row[0]
+
+    def update(self, statuses):
+        """
+        Writes several (url, status) pairs in a single transaction.
+        Nothing is written if any pair fails.
+        """
+        self.connection.execute("BEGIN")
+        try:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO links (url, status) VALUES (?, ?)", statuses)
+        except Exception:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    def close(self):
+        """
+        Closes the database connection.
+        """
+        self.connection.close()
+
+
 class FileOperation:
     """
     Handles file operations such as reading/writing files and saving content to files.
@@ -20,57 +128,81 @@ class FileOperation:
         if not os.path.exists(self.data_folder):
             os.makedirs(self.data_folder)
         self.visitedlinks = self.load_status()
+        self.extralinks_buffer = []
+        atexit.register(self.flush_extralinks)
 
     def load_status(self):
         """
-        Loads the status of visited links from a JSON file.
-        Returns a dictionary with the visited links and their status.
+        Opens the SQLite database holding the status of visited links.
+        A linkscraped.json left by an older version is imported the first time.
         """
-        if os.path.exists(self.status_file):
-            with open(self.status_file, 'r', encoding='utf-8') as file:
-                return json.load(file)
-        return {}
+        visitedlinks = LinkStatus(self.status_file)
+        legacy_file = os.path.join(self.data_folder, "linkscraped.json")
+        if not len(visitedlinks) and os.path.exists(legacy_file):
+            with open(legacy_file, 'r', encoding='utf-8') as file:
+                visitedlinks.update(json.load(file).items())
+        return visitedlinks
 
-    def save_status(self):
+    def close_status(self):
         """
-        Saves the current status of visited links to a JSON file.
+        Closes the status database and flushes any buffered external links.
+        Every status change is already written as it happens.
         """
-        with open(self.status_file, 'w', encoding='utf-8') as file:
-            json.dump(self.visitedlinks, file, indent=4)
+        self.flush_extralinks()
+        self.visitedlinks.close()
 
     def create_file(self, url):
         """
         Generates a filename based on the URL by converting the URL path to a valid filename.
         Returns the full path to the file where the content will be saved.
         """
-        parsed_url = urlparse(url)
-        path = parsed_url.path.strip("/").replace("/", "_")
-        if not path:
-            path = "index"
-        return os.path.join(self.data_folder, f"{parsed_url.netloc}_{path}.txt")
+        return url_to_filename(self.data_folder, url)
+
+    def has_file(self, url):
+        """
+        Checks whether the content of a URL has already been saved to the data folder.
+        """
+        filename = self.create_file(url)
+        if PDF_PATTERN.search(url):
+            filename = filename.replace(".txt", ".pdf")
+        return os.path.exists(filename)
 
-    def write_pdf(self, url, content):
+    async def write_pdf(self, url, response, chunk_size=64 * 1024):
         """
-        Writes PDF content to a file named based on the URL.
+        Streams the PDF body of an aiohttp response to a file named based on the URL,
+        chunk_size bytes at a time, so the whole document is never held in memory.
         """
         filename = self.create_file(url).replace(".txt", ".pdf")
-        with open(filename, 'wb') as pdf_file:
-            pdf_file.write(content)
+        async with aiofiles.open(filename, 'wb') as pdf_file:
+            async for chunk in response.content.iter_chunked(chunk_size):
+                await pdf_file.write(chunk)
 
-    def write_text(self, url, content):
+    async def write_text(self, url, content):
         """
         Writes text content to a file named based on the URL.
         """
         filename = self.create_file(url)
-        with open(filename, 'w', encoding='utf-8') as file:
-            file.write(content)
+        async with aiofiles.open(filename, 'w', encoding='utf-8') as file:
+            await file.write(content)
 
-    def add_to_extralinks(self, url):
+    def add_to_extralinks(self, url, buffer_size=1024):
         """
-        Appends non-domain links to an external links file for further analysis.
+        Buffers non-domain links for the external links file, for further analysis.
+        The buffer is appended to the file once it holds buffer_size links.
         """
+        self.extralinks_buffer.append(url)
+        if len(self.extralinks_buffer) >= buffer_size:
+            self.flush_extralinks()
+
+    def flush_extralinks(self):
+        """
+        Appends all buffered external links to the external links file in a single write.
+        """
+        if not self.extralinks_buffer:
+            return
         with open("extralinks.txt", "a") as f:
-            f.write(url + "\n")
+            f.write("\n".join(self.extralinks_buffer) + "\n")
+        self.extralinks_buffer.clear()
 
 
 class URLcheck:
@@ -87,148 +219,257 @@ class URLcheck:
         """
         Checks if a given URL belongs to the domain being scraped.
         Returns True if the URL is within the domain, otherwise False.
+        Compares the text after "//" directly rather than parsing the whole URL,
+        and only for http, https and scheme-relative URLs.
         """
-        parsed_url = urlparse(url)
-        return parsed_url.netloc == self.domain
+        scheme, separator, rest = url.partition("//")
+        if not separator or scheme.lower() not in ("", "http:", "https:"):
+            return False
+        if not rest.startswith(self.domain):
+            return False
+        return rest[len(self.domain):len(self.domain) + 1] in ("", "/", "?", "#")
 
     def extract_links(self, soup, base_url):
         """
         Extracts and validates all links from the given BeautifulSoup object.
-        Only adds links that belong to the same domain as the base URL.
+        Returns the set of links that belong to the same domain as the base URL
+        and the list of links that point elsewhere.
         """
         links = set()
+        extralinks = []
         for a_tag in soup.find_all('a', href=True):
-            href = a_tag['href']
-            full_url = urljoin(base_url, href)
-            if self.check_link(full_url):
-                links.add(full_url)
+            href = a_tag['href'].strip()
+            if not href or IGNORED_HREF_PATTERN.match(href):
+                continue
+            if not ABSOLUTE_HREF_PATTERN.match(href):
+                # Relative links always resolve inside the page's own domain
+                links.add(urljoin(base_url, href))
+                continue
+            if self.check_link(href):
+                links.add(urljoin(base_url, href))
             else:
-                file_op.add_to_extralinks(full_url)
-        return links
+                extralinks.append(urljoin(base_url, href) if href.startswith("//") else href)
+        return links, extralinks
+
+
+def parse_page(content, url, crawler):
+    """
+    Parses the HTML content of a page.
+    Returns the page's main text, its in-domain links and its external links.
+    Defined at module level so it can run in a ProcessPoolExecutor.
+    """
+    link_soup = BeautifulSoup(content, 'lxml', parse_only=SoupStrainer('a', href=True))
+    links, extralinks = crawler.extract_links(link_soup, url)
+    return extract_main_text(content), links, extralinks
+
+
+def extract_main_text(content):
+    """
+    Extracts the text of the page's <main> element, or of the whole page when it has none.
+    Scripts, styles, navigation, headers, footers and images are stripped first.
+    """
+    tree = LexborHTMLParser(content)
+    for node in tree.css("script, style, nav, header, footer, img"):
+        node.decompose()
+    main_content = tree.css_first("main")
+    if main_content is not None:
+        return main_content.text(separator="\n", strip=True)
+    if tree.root is None:
+        return ""
+    return tree.root.text(strip=True)
+
+
+class RateLimiter:
+    """
+    Spaces out requests so that each host receives at most a fixed number per second.
+    """
+    def __init__(self, requests_per_second):
+        """
+        Initializes the RateLimiter class with the maximum request rate allowed per host.
+        """
+        self.interval = 1 / requests_per_second
+        self.next_slot = {}
+
+    async def wait(self, url):
+        """
+        Reserves the next free request slot for the URL's host and sleeps until it arrives.
+        """
+        host = urlparse(url).netloc
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self.next_slot.get(host, now))
+        self.next_slot[host] = slot + self.interval
+        await asyncio.sleep(slot - now)
 
 
 class Scraper:
     """
     Asynchronously scrapes web pages, processes content, and handles linked resources.
     """
-    def __init__(self, file_op, crawler, lock, request_delay):
+    def __init__(self, file_op, crawler, limiter, num_workers=20):
         """
         Initializes the Scraper class with the necessary components for scraping.
+        num_workers bounds how many URLs are processed concurrently.
         """
         self.file_op = file_op
         self.crawler = crawler
-        self.lock = lock
-        self.request_delay = request_delay
+        self.limiter = limiter
+        self.num_workers = num_workers
+        self.pool = None
+
+    async def run(self, session, start_url):
+        """
+        Crawls the site starting from start_url using a fixed pool of workers
+        that share a queue of URLs, with HTML parsing offloaded to a process pool.
+        Returns once the queue has been drained.
+        When resuming, every known URL that did not succeed or whose file is missing
+        is queued again, while completed pages are not fetched a second time.
+        """
+        queue = asyncio.Queue()
+        visitedlinks = self.file_op.visitedlinks
+        seeds = list(visitedlinks.unfinished())
+        seeds.extend(url for url in visitedlinks.finished() if not self.file_op.has_file(url))
+        if start_url not in visitedlinks:
+            seeds.append(start_url)
+        for url in seeds:
+            self.enqueue(queue, url)
+        workers = []
+        try:
+            # Spawned rather than forked, since the resolver and aiofiles already run threads
+            self.pool = ProcessPoolExecutor(max_workers=os.cpu_count(),
+                                            mp_context=multiprocessing.get_context("spawn"))
+            workers = [asyncio.create_task(self.worker(session, queue))
+                       for _ in range(self.num_workers)]
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            if self.pool is not None:
+                self.pool.shutdown()
+                self.pool = None
+
+    def enqueue(self, queue, url):
+        """
+        Marks a URL as queued and adds it to the work queue.
+        """
+        self.file_op.visitedlinks[url] = "queued"
+        queue.put_nowait(url)
+
+    async def worker(self, session, queue):
+        """
+        Takes URLs off the queue and scrapes or downloads them until cancelled.
+        """
+        while True:
+            url = await queue.get()
+            try:
+                if PDF_PATTERN.search(url):
+                    await self.download_pdf(session, url)
+                else:
+                    await self.scrape(session, url, queue)
+            except Exception as e:
+                print(f"An error occurred while visiting {url}: {e}")
+                self.file_op.visitedlinks[url] = "failed"
+            finally:
+                queue.task_done()
 
     async def fetch(self, session, url):
         """
         Asynchronously fetches the content of a given URL using aiohttp.
         Returns the content of the page if successful, otherwise None.
         """
+        await self.limiter.wait(url)
         async with session.get(url) as response:
             if response.status == 200:
                 return await response.text()
             else:
                 return None
 
-    async def process_page(self, soup, url):
+    async def scrape(self, session, url, queue):
         """
-        Processes the HTML content of a page, extracts main text, and saves it.
+        Scrapes a given URL, processes its content, and queues linked pages
+        that have not been seen before.
         """
-        for script in soup(["script", "style", "nav", "header", "footer", "img"]):
-            script.extract()
-        main_text = soup.get_text(strip=True)
-        main_content = soup.find("main")
-        if main_content:
-            main_text = main_content.get_text("\n", strip=True)
-        self.file_op.write_text(url, main_text)
-
-    async def scrape(self, session, url):
-        """
-        Scrapes a given URL, processes its content, and recursively scrapes linked pages.
-        """
-        async with self.lock:
-            if url in self.file_op.visitedlinks:
-                return
-            self.file_op.visitedlinks[url] = "pending"
+        self.file_op.visitedlinks[url] = "pending"
         print(f"Visiting: {url}")
 
         content = await self.fetch(session, url)
         if content is None:
-            async with self.lock:
-                self.file_op.visitedlinks[url] = "failed"
+            self.file_op.visitedlinks[url] = "failed"
             return
 
-        async with self.lock:
-            self.file_op.visitedlinks[url] = "success"
-
         try:
-            soup = BeautifulSoup(content, 'html.parser')
-            links = self.crawler.extract_links(soup, url)
-            await self.process_page(soup, url)
-            tasks = []
+            loop = asyncio.get_running_loop()
+            main_text, links, extralinks = await loop.run_in_executor(
+                self.pool, parse_page, content, url, self.crawler)
+            await self.file_op.write_text(url, main_text)
+            for link in extralinks:
+                self.file_op.add_to_extralinks(link)
             for link in links:
-                if any(substring in link.lower() for substring in ["lxml"]):
+                # No await between the check and enqueue, so no other worker can claim the link
+                if link in self.file_op.visitedlinks or SKIP_PATTERN.search(link):
                     continue
-                if link.lower().endswith(".pdf"):
-                    tasks.append(self.download_pdf(session, link))
-                else:
-                    tasks.append(self.scrape(session, link))
-            await asyncio.gather(*tasks)
-            await asyncio.sleep(self.request_delay)
+                self.enqueue(queue, link)
+            # Marked last so a page interrupted mid-processing is re-expanded on resume
+            self.file_op.visitedlinks[url] = "success"
         except Exception as e:
             print(f"An error occurred while processing {url}: {e}")
-
-        self.file_op.save_status()
+            self.file_op.visitedlinks[url] = "failed"
 
     async def download_pdf(self, session, url):
         """
         Asynchronously downloads and saves a PDF from a given URL.
         """
+        self.file_op.visitedlinks[url] = "pending"
         try:
+            await self.limiter.wait(url)
             async with session.get(url) as response:
                 if response.status == 200:
-                    self.file_op.write_pdf(url, await response.read())
-                    async with self.lock:
-                        self.file_op.visitedlinks[url] = "success"
+                    await self.file_op.write_pdf(url, response)
+                    self.file_op.visitedlinks[url] = "success"
                 else:
-                    async with self.lock:
-                        self.file_op.visitedlinks[url] = "failed"
+                    self.file_op.visitedlinks[url] = "failed"
         except Exception as e:
             print(f"Failed to download PDF {url}: {e}")
-            async with self.lock:
-                self.file_op.visitedlinks[url] = "failed"
+            self.file_op.visitedlinks[url] = "failed"
 
 
-# Setup
-mainurl = "https://www.wscacademy.org/"
-domain = urlparse(mainurl).netloc
-data_folder = "wscadata"
-status_file = os.path.join(data_folder, "linkscraped.json")
+async def main(scraper, start_url):
+    """
+    Main entry point for the asynchronous scraping operation.
+    Initializes an aiohttp session and crawls the site from the start URL.
+    """
+    connector = aiohttp.TCPConnector(limit=100, limit_per_host=20,
+                                     ttl_dns_cache=300, keepalive_timeout=60)
+    timeout = aiohttp.ClientTimeout(sock_connect=10, sock_read=30)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        await scraper.run(session, start_url)
 
-file_op = FileOperation(data_folder, status_file)
-urlcheck = URLcheck(domain)
-lock = asyncio.Lock()
-request_delay = 1  # Delay in seconds between requests
 
-scraper = Scraper(file_op, urlcheck, lock, request_delay)
+if __name__ == "__main__":
+    # Setup
+    mainurl = "https://www.wscacademy.org/"
+    domain = urlparse(mainurl).netloc
+    data_folder = "wscadata"
+    status_file = os.path.join(data_folder, "linkscraped.db")
 
-# Measure the time taken for the entire scraping process
-start_time = time.time()
+    file_op = FileOperation(data_folder, status_file)
+    urlcheck = URLcheck(domain)
+    limiter = RateLimiter(10)  # Maximum requests per second sent to each host
+    num_workers = 20  # Number of pages processed concurrently
 
-async def main():
-    """
-    Main entry point for the asynchronous scraping operation.
-    Initializes an aiohttp session and starts scraping from the main URL.
-    """
-    async with aiohttp.ClientSession() as session:
-        await scraper.scrape(session, mainurl)
+    scraper = Scraper(file_op, urlcheck, limiter, num_workers)
+
+    # Measure the time taken for the entire scraping process
+    start_time = time.time()
 
-# Start scraping the main URL
-asyncio.run(main())
+    # Start scraping the main URL
+    try:
+        asyncio.run(main(scraper, mainurl))
+    finally:
+        file_op.close_status()
 
-end_time = time.time()
-overall_time = end_time - start_time
+    end_time = time.time()
+    overall_time = end_time - start_time
 
-print(f"Done! Check Data")
-print(f"Total time taken: {overall_time} seconds")
\ No newline at end of file
+    print(f"Done! Check Data")
+    print(f"Total time taken: {overall_time} seconds")
\ No newline at end of file